@@ -1,81 +1,284 @@
-from flask import Flask
-import threading
+import asyncio
+import concurrent.futures
+import contextlib
+import hashlib
 import io
 import os
+import signal
 import tempfile
+import threading
+import warnings
+from collections import OrderedDict
+from dataclasses import dataclass, field
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    filters, ContextTypes
+    ConversationHandler, TypeHandler, filters, ContextTypes
 )
+from telegram.warnings import PTBUserWarning
 
+from aiohttp import web
 from PIL import Image
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, error as ID3Error
-from mutagen.mp3 import MP3
-from mutagen.mp3 import HeaderNotFoundError as MP3HeaderNotFoundError
+from mutagen import MutagenError
+from mutagen.id3 import ID3, APIC, TIT2, TPE1, ID3NoHeaderError
 
-try:
-    from pydub import AudioSegment
-    HAVE_PYDUB = True
-except Exception:
-    HAVE_PYDUB = False
+# The buttons belong to the user's conversation, not to one message, so
+# per_message=False is intended; silence PTB's startup warning about it
+warnings.filterwarnings("ignore", message="If 'per_message=False'", category=PTBUserWarning)
 
 # Session data
-user_audio_path = {}
-user_image_path = {}
-user_title = {}
-user_artist = {}
-user_waiting_for = {}  # "title", "artist", "image"
-user_processed = {}    # To track if user has finished processing
+@dataclass
+class Session:
+    tmpdir: tempfile.TemporaryDirectory = None  # holds every file of this session
+    filename: str = None
+    audio_path: str = None
+    is_mp3: bool = False
+    image_path: str = None
+    title: str = None
+    artist: str = None
+    padding_task: asyncio.Future = None
+    # Cover encodes keyed by (image_path, max_size, mtime), reused on a retried Finish
+    covers: dict = field(default_factory=dict)
+    processed: bool = False  # To track if user has finished processing
+
+SESSIONS = {}
+
+# Per-user locks with the number of coroutines holding or waiting on each
+USER_LOCKS = {}
+
+@contextlib.asynccontextmanager
+async def _user_lock(user_id):
+    lock, users = USER_LOCKS.get(user_id, (asyncio.Lock(), 0))
+    USER_LOCKS[user_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = USER_LOCKS[user_id]
+        if users == 1:
+            del USER_LOCKS[user_id]
+        else:
+            USER_LOCKS[user_id] = (lock, users - 1)
+
+# Conversation states
+MENU, TITLE, ARTIST, IMAGE = range(4)
+
+# Unfinished sessions are dropped (and their files removed) after this long
+SESSION_TIMEOUT = 30 * 60
+
+def _sess(user_id) -> Session:
+    return SESSIONS.setdefault(user_id, Session())
+
+async def _close_session(session: Session):
+    # Caller holds the user's lock; wait for the padding thread before
+    # removing the directory it writes into
+    if session is None:
+        return
+    if session.padding_task:
+        await session.padding_task
+    if session.tmpdir:
+        session.tmpdir.cleanup()
+        session.tmpdir = None
+    session.covers.clear()
+
+# Blocking Pillow/mutagen/file work runs here so the event loop stays free
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Encoded covers keyed by (sha1 of the source image, max_size), most recent last
+COVER_CACHE = OrderedDict()
+COVER_CACHE_SIZE = 128
+COVER_CACHE_LOCK = threading.Lock()
 
 INTRO_TEXT = (
     "Hi! 😎 I can add an image on an audio file, or change its title and artist name. Just send me an audio file to start! 🎵\n\n"
     "Developer: Rayan"
 )
 
-# Flask keep-alive
-app_server = Flask('')
-
-@app_server.route('/')
-def home():
-    return "Bot is running!"
-
-def run_server():
-    app_server.run(host='0.0.0.0', port=8080)
-
-def keep_alive():
-    thread = threading.Thread(target=run_server)
-    thread.start()
+# Keep-alive endpoint (and webhook receiver), served from the bot's own event loop
+async def home(request):
+    return web.Response(text="Bot is running!")
+
+async def webhook(request):
+    application = request.app["application"]
+    await application.update_queue.put(Update.de_json(await request.json(), application.bot))
+    return web.Response()
+
+async def _start_server(application: Application, webhook_path: str = None) -> web.AppRunner:
+    server = web.Application()
+    server["application"] = application
+    server.router.add_get('/', home)
+    if webhook_path:
+        server.router.add_post(f'/{webhook_path}', webhook)
+    runner = web.AppRunner(server)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', 8080).start()
+    return runner
+
+async def keep_alive(application: Application):
+    application.bot_data["keep_alive_runner"] = await _start_server(application)
+
+async def stop_keep_alive(application: Application):
+    runner = application.bot_data.pop("keep_alive_runner", None)
+    if runner:
+        await runner.cleanup()
 
 # Utilities
+def _id3_size(head: bytes) -> int:
+    # Full length of an ID3v2 tag from its 10-byte header (syncsafe size + footer)
+    size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+def _sniff_codec(head: bytes) -> str:
+    """Guess the codec from the first bytes: 'mp3', 'other' or 'unknown'."""
+    # AAC and FLAC files often carry an ID3v2 tag too; look at what follows it
+    while head[:3] == b"ID3" and len(head) >= 10:
+        head = head[_id3_size(head):]
+    if head[:3] == b"ID3":
+        return "unknown"
+    # MPEG audio frame sync; layer bits 00 is ADTS AAC, not MP3
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0:
+        return "mp3" if head[1] & 0x06 else "other"
+    if head[:4] in (b"fLaC", b"OggS", b"RIFF", b"FORM", b"\x1aE\xdf\xa3") or head[4:8] == b"ftyp":
+        return "other"
+    return "unknown"
+
 def _is_mp3(path: str) -> bool:
+    # Only the first bytes after any ID3v2 tags are read
     try:
-        _ = MP3(path)
-        return True
-    except MP3HeaderNotFoundError:
-        return False
-    except Exception:
-        return False
-
-def _convert_to_mp3_if_needed(src_path: str) -> str:
-    if _is_mp3(src_path):
-        return src_path
-    if not HAVE_PYDUB:
+        with open(path, "rb") as f:
+            head = f.read(12)
+            while head[:3] == b"ID3" and len(head) >= 10:
+                f.seek(f.tell() - len(head) + _id3_size(head))
+                head = f.read(12)
+    except OSError:
+        head = b""
+    codec = _sniff_codec(head)
+    if codec == "unknown":
+        return path.lower().endswith(".mp3")
+    return codec == "mp3"
+
+async def _run(*cmd: str) -> tuple:
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except FileNotFoundError:
         raise RuntimeError("Your audio isn't MP3 and conversion is unavailable.")
-    audio = AudioSegment.from_file(src_path)
-    mp3_path = src_path + ".mp3"
-    audio.export(mp3_path, format="mp3", bitrate="192k")
+    out, err = await proc.communicate()
+    return proc.returncode, out.decode(errors="replace"), err.decode(errors="replace")
+
+async def _probe_audio_codec(src_path: str) -> str:
+    code, out, _ = await _run(
+        "ffprobe", "-v", "error", "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name", "-of", "csv=p=0", src_path)
+    return out.strip() if code == 0 else ""
+
+async def _convert_to_mp3_if_needed(src_path: str, is_mp3: bool = None) -> str:
+    if is_mp3 is None:
+        is_mp3 = _is_mp3(src_path)
+    if is_mp3:
+        return src_path
+    mp3_path = os.path.join(os.path.dirname(src_path), "tagged.mp3")
+    # Remux when the stream is already MP3, only transcode otherwise
+    if await _probe_audio_codec(src_path) == "mp3":
+        code, _, _ = await _run("ffmpeg", "-y", "-i", src_path, "-vn", "-c:a", "copy", mp3_path)
+        if code == 0:
+            return mp3_path
+    code, _, err = await _run(
+        "ffmpeg", "-y", "-i", src_path, "-vn", "-c:a", "libmp3lame", "-b:a", "192k", mp3_path)
+    if code != 0:
+        raise RuntimeError(err.strip().splitlines()[-1] if err.strip() else "ffmpeg failed")
     return mp3_path
 
 def _prepare_cover_image_to_jpeg_bytes(image_path: str, max_size: int = 1000) -> bytes:
     with Image.open(image_path) as im:
+        # Let libjpeg downscale during decode (no-op for other formats)
+        im.draft("RGB", (max_size, max_size))
         im = im.convert("RGB")
-        im.thumbnail((max_size, max_size))
+        # Cheap integer box reduce for PNG/WebP etc. before the bicubic pass
+        factor = min(im.width // max_size, im.height // max_size)
+        if factor >= 2:
+            im = im.reduce(factor)
+        im.thumbnail((max_size, max_size), Image.Resampling.BICUBIC)
         buf = io.BytesIO()
-        im.save(buf, format="JPEG", quality=90, optimize=True)
+        im.save(buf, format="JPEG", quality=82, optimize=True,
+                progressive=True, subsampling="4:2:0")
         return buf.getvalue()
 
+def _cover_jpeg_bytes(image_path: str, max_size: int = 1000) -> bytes:
+    # Popular album art gets sent by many users; encode each image only once
+    with open(image_path, "rb") as f:
+        key = (hashlib.sha1(f.read()).digest(), max_size)
+    with COVER_CACHE_LOCK:
+        if key in COVER_CACHE:
+            COVER_CACHE.move_to_end(key)
+            return COVER_CACHE[key]
+    cover_bytes = _prepare_cover_image_to_jpeg_bytes(image_path, max_size)
+    with COVER_CACHE_LOCK:
+        COVER_CACHE[key] = cover_bytes
+        if len(COVER_CACHE) > COVER_CACHE_SIZE:
+            COVER_CACHE.popitem(last=False)
+    return cover_bytes
+
+# Room for a 1000px cover (typically 100-200 KB at q82) plus text frames, so
+# Set Image fits in the padding too
+TAG_PADDING = 256 * 1024
+
+def _tag_padding(info) -> int:
+    # Reuse existing padding so mutagen patches the tag in place; only grow
+    # (and rewrite the file) when the new tag doesn't fit
+    return info.padding if info.padding >= 0 else TAG_PADDING
+
+def _ensure_padding(path: str):
+    # Best effort: pay for one full rewrite now so later tag edits fit in place
+    try:
+        try:
+            tags = ID3(path)
+        except ID3NoHeaderError:
+            tags = ID3()
+        tags.save(path, v2_version=3, padding=lambda info: max(info.padding, TAG_PADDING))
+    except (MutagenError, OSError):
+        pass
+
+def _write_tags(path: str, cover_bytes: bytes = None, title: str = None, artist: str = None):
+    # Only the ID3 block is touched; the MPEG frames are never parsed
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        tags = ID3()
+
+    # Only overwrite metadata if user set it
+    if cover_bytes:
+        tags.delall("APIC")
+        tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover_bytes))
+
+    # Preserve existing tags if user didn't set them
+    existing_title = tags.get('TIT2')
+    existing_artist = tags.get('TPE1')
+
+    if title:
+        tags.add(TIT2(encoding=3, text=[title]))
+    elif existing_title:
+        tags.add(existing_title)
+
+    if artist:
+        tags.add(TPE1(encoding=3, text=[artist]))
+    elif existing_artist:
+        tags.add(existing_artist)
+
+    tags.save(path, v2_version=3, padding=_tag_padding)
+
+    final_title = tags.get('TIT2')
+    final_artist = tags.get('TPE1')
+    # Same "/" separator mutagen uses for multi-valued frames in v2.3
+    return ("/".join(final_title.text) if final_title else None,
+            "/".join(final_artist.text) if final_artist else None)
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(INTRO_TEXT)
 
@@ -83,71 +286,114 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     tg_file = await msg.audio.get_file()
     ext = os.path.splitext(tg_file.file_path or "")[1].lower() or ".bin"
-    tmp_audio = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-    tmp_audio_path = tmp_audio.name
-    tmp_audio.close()
+    tmpdir = tempfile.TemporaryDirectory()
+    tmp_audio_path = os.path.join(tmpdir.name, "audio" + ext)
     await tg_file.download_to_drive(tmp_audio_path)
 
     user_id = msg.from_user.id
-    user_audio_path[user_id] = tmp_audio_path
-    user_image_path.pop(user_id, None)
-    user_title.pop(user_id, None)
-    user_artist.pop(user_id, None)
-    user_processed[user_id] = False
+    # Waits for a Finish still running on the previous upload, then removes
+    # the previous session's files
+    async with _user_lock(user_id):
+        await _close_session(SESSIONS.get(user_id))
+        session = SESSIONS[user_id] = Session(
+            tmpdir=tmpdir, filename=msg.audio.file_name or "audio" + ext,
+            audio_path=tmp_audio_path, is_mp3=_is_mp3(tmp_audio_path))
+    if session.is_mp3:
+        # Non-MP3 files get replaced by ffmpeg output, so only pad real MP3s
+        session.padding_task = asyncio.get_running_loop().run_in_executor(
+            EXECUTOR, _ensure_padding, tmp_audio_path)
 
     await ask_next_action(update, user_id)
+    return MENU
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    user_id = query.from_user.id
     await query.answer()
 
-    if user_processed.get(user_id):
-        # If already processed, no further action needed
-        await query.message.reply_text("✅ You’ve already processed this audio. Send a new one to start again.")
-        return
-
     if query.data == "setimage":
-        user_waiting_for[user_id] = "image"
         await query.message.reply_text("Please send me the image you want as cover.")
+        return IMAGE
     elif query.data == "settitle":
-        user_waiting_for[user_id] = "title"
         await query.message.reply_text("Please type the title you want.")
+        return TITLE
     elif query.data == "setartist":
-        user_waiting_for[user_id] = "artist"
         await query.message.reply_text("Please type the artist name you want.")
-    elif query.data == "finish":
-        await process_and_send(update, context, user_id)
+        return ARTIST
 
-async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+    await query.answer()
+    await process_and_send(update, context, user_id)
+    return ConversationHandler.END if _sess(user_id).processed else MENU
+
+async def handle_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    async with _user_lock(user_id):
+        await _close_session(SESSIONS.pop(user_id, None))
+    if update.effective_message:
+        await update.effective_message.reply_text("⌛ Session expired. Send the audio again to start over.")
+
+async def handle_busy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Runs while a non-blocking Finish is still building this user's file
+    if update.callback_query:
+        await update.callback_query.answer()
+    await update.effective_message.reply_text("⏳ Still working on your file…")
+
+async def handle_stale_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    session = SESSIONS.get(query.from_user.id)
+    if session and session.audio_path is not None:
+        await query.message.reply_text("⏳ Still working on your file…")
+    elif session and session.processed:
+        # If already processed, no further action needed
+        await query.message.reply_text("✅ You’ve already processed this audio. Send a new one to start again.")
+    else:
+        await query.message.reply_text("No audio found in your session.")
+
+async def set_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    if user_id not in user_waiting_for:
-        return
-    mode = user_waiting_for.pop(user_id)
-    if mode == "title":
-        user_title[user_id] = update.message.text
-        await update.message.reply_text(f"Title set to: {update.message.text}")
-    elif mode == "artist":
-        user_artist[user_id] = update.message.text
-        await update.message.reply_text(f"Artist set to: {update.message.text}")
+    async with _user_lock(user_id):
+        session = _sess(user_id)
+        if session.tmpdir is None:
+            await update.message.reply_text("No audio found in your session.")
+            return ConversationHandler.END
+        session.title = update.message.text
+    await update.message.reply_text(f"Title set to: {update.message.text}")
     await ask_next_action(update, user_id)
+    return MENU
 
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def set_artist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    if user_waiting_for.get(user_id) != "image":
-        return
-    user_waiting_for.pop(user_id, None)
-    tg_file = await update.message.photo[-1].get_file()
-    tmp_img = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-    tmp_img_path = tmp_img.name
-    tmp_img.close()
-    await tg_file.download_to_drive(tmp_img_path)
-    user_image_path[user_id] = tmp_img_path
+    async with _user_lock(user_id):
+        session = _sess(user_id)
+        if session.tmpdir is None:
+            await update.message.reply_text("No audio found in your session.")
+            return ConversationHandler.END
+        session.artist = update.message.text
+    await update.message.reply_text(f"Artist set to: {update.message.text}")
+    await ask_next_action(update, user_id)
+    return MENU
+
+async def set_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    # Held across the download so Finish can't wipe the tmpdir underneath it
+    async with _user_lock(user_id):
+        session = _sess(user_id)
+        if session.tmpdir is None:
+            await update.message.reply_text("No audio found in your session.")
+            return ConversationHandler.END
+        tg_file = await update.message.photo[-1].get_file()
+        tmp_img_path = os.path.join(session.tmpdir.name, "cover.jpg")
+        await tg_file.download_to_drive(tmp_img_path)
+        session.image_path = tmp_img_path
     await update.message.reply_text("Image saved!")
     await ask_next_action(update, user_id)
+    return MENU
 
 async def ask_next_action(update_or_msg, user_id):
-    if user_processed.get(user_id):
+    if _sess(user_id).processed:
         return  # no menu after finishing
 
     keyboard = [
@@ -164,88 +410,124 @@ async def ask_next_action(update_or_msg, user_id):
             reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def process_and_send(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
-    if user_id not in user_audio_path:
-        await update.callback_query.message.reply_text("No audio found in your session.")
-        return
-
-    audio_path_original = user_audio_path[user_id]
-    image_path = user_image_path.get(user_id)
-
-    try:
-        audio_path_for_tagging = _convert_to_mp3_if_needed(audio_path_original)
-    except Exception as e:
-        await update.callback_query.message.reply_text(f"❌ Error converting audio: {e}")
-        return
-
-    try:
-        audio = MP3(audio_path_for_tagging, ID3=ID3)
-        if audio.tags is None:
-            audio.add_tags()
-
-        # Only overwrite metadata if user set it
+    async with _user_lock(user_id):
+        session = _sess(user_id)
+        if session.audio_path is None:
+            await update.callback_query.message.reply_text("No audio found in your session.")
+            return
+
+        audio_path_original = session.audio_path
+        image_path = session.image_path
+
+        # Encode the cover on the pool while ffmpeg converts the audio
+        loop = asyncio.get_running_loop()
+        cover_task = None
         if image_path:
-            cover_bytes = _prepare_cover_image_to_jpeg_bytes(image_path, max_size=1000)
-            for k in list(audio.tags.keys()):
-                if k.startswith("APIC"):
-                    del audio.tags[k]
-            audio.tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover_bytes))
-
-        # Preserve existing tags if user didn't set them
-        existing_title = audio.tags.get('TIT2')
-        existing_artist = audio.tags.get('TPE1')
-
-        if user_id in user_title and user_title[user_id]:
-            audio.tags.add(TIT2(encoding=3, text=[user_title[user_id]]))
-        elif existing_title:
-            audio.tags.add(existing_title)
-
-        if user_id in user_artist and user_artist[user_id]:
-            audio.tags.add(TPE1(encoding=3, text=[user_artist[user_id]]))
-        elif existing_artist:
-            audio.tags.add(existing_artist)
-
-        audio.save(v2_version=3)
-
-        filename = os.path.basename(audio_path_original)
-        if not filename.lower().endswith(".mp3"):
-            filename = os.path.splitext(filename)[0] + ".mp3"
-
-        with open(audio_path_for_tagging, "rb") as f:
-            await update.callback_query.message.reply_document(document=f, filename=filename)
-        await update.callback_query.message.reply_text("✅ Done! Your audio is ready.")
-
-        user_processed[user_id] = True
-
-    except Exception as e:
-        await update.callback_query.message.reply_text(f"❌ Tagging failed: {e}")
-    finally:
-        # cleanup
-        try: os.unlink(audio_path_for_tagging)
-        except: pass
-        if audio_path_for_tagging != audio_path_original:
-            try: os.unlink(audio_path_original)
-            except: pass
-        if image_path:
-            try: os.unlink(image_path)
-            except: pass
-        user_audio_path.pop(user_id, None)
-        user_image_path.pop(user_id, None)
-        user_title.pop(user_id, None)
-        user_artist.pop(user_id, None)
-
-import os  # make sure this is at the top of your file
+            key = (image_path, 1000, os.path.getmtime(image_path))
+            cover_task = session.covers.get(key)
+            if cover_task is None:
+                cover_task = session.covers[key] = loop.run_in_executor(
+                    EXECUTOR, _cover_jpeg_bytes, image_path, 1000)
+
+        try:
+            audio_path_for_tagging = await _convert_to_mp3_if_needed(audio_path_original, session.is_mp3)
+        except Exception as e:
+            # The cover encode keeps running and stays memoized for a retry
+            await update.callback_query.message.reply_text(f"❌ Error converting audio: {e}")
+            return
+
+        try:
+            if session.padding_task:
+                await session.padding_task
+            cover_bytes = await cover_task if cover_task else None
+            final_title, final_artist = await loop.run_in_executor(
+                EXECUTOR, _write_tags, audio_path_for_tagging, cover_bytes,
+                session.title, session.artist)
+
+            filename = session.filename
+            if not filename.lower().endswith(".mp3"):
+                filename = os.path.splitext(filename)[0] + ".mp3"
+
+            data = await loop.run_in_executor(EXECUTOR, _read_bytes, audio_path_for_tagging)
+            await update.callback_query.message.reply_audio(
+                audio=data, filename=filename,
+                title=final_title, performer=final_artist)
+            await update.callback_query.message.reply_text("✅ Done! Your audio is ready.")
+
+            session.processed = True
+
+        except Exception as e:
+            await update.callback_query.message.reply_text(f"❌ Tagging failed: {e}")
+        finally:
+            # cleanup
+            await _close_session(session)
+            session.audio_path = session.image_path = None
+            session.title = session.artist = None
+
+async def run_webhook(application: Application, token: str, webhook_url: str):
+    # PTB's own webhook server only routes /<token>, so serve the webhook
+    # next to the keep-alive route on one aiohttp server instead
+    async with application:
+        await application.bot.set_webhook(webhook_url)
+        await application.start()
+        runner = await _start_server(application, webhook_path=token)
+        # Like run_polling: stop cleanly on Ctrl+C and on container stop
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            with contextlib.suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            await application.stop()
 
 def main():
     print("Starting bot…")
-    app = Application.builder().token(os.environ["BOT_TOKEN"]).build()
+    token = os.environ["BOT_TOKEN"]
+    public_url = os.environ.get("PUBLIC_URL")
+    builder = Application.builder().token(token)
+    if public_url:
+        builder = builder.updater(None)
+    else:
+        builder = builder.post_init(keep_alive).post_shutdown(stop_keep_alive)
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
-    app.add_handler(MessageHandler(filters.AUDIO, handle_audio))
-    app.add_handler(CallbackQueryHandler(handle_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    print("Bot is polling.")
-    app.run_polling()
+    # Finish is non-blocking so other users' updates aren't held up behind it;
+    # meanwhile the conversation ignores this user's other updates
+    menu = [
+        CallbackQueryHandler(handle_callback, pattern="^set"),
+        CallbackQueryHandler(handle_finish, pattern="^finish$", block=False),
+    ]
+    app.add_handler(ConversationHandler(
+        entry_points=[MessageHandler(filters.AUDIO, handle_audio)],
+        states={
+            MENU: menu,
+            TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_title), *menu],
+            ARTIST: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_artist), *menu],
+            IMAGE: [MessageHandler(filters.PHOTO, set_image), *menu],
+            ConversationHandler.WAITING: [
+                CallbackQueryHandler(handle_busy),
+                MessageHandler(filters.AUDIO, handle_busy),
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, handle_timeout)],
+        },
+        fallbacks=[],
+        allow_reentry=True,
+        conversation_timeout=SESSION_TIMEOUT,
+    ))
+    app.add_handler(CallbackQueryHandler(handle_stale_callback))
+    if public_url:
+        # Telegram pushes updates to us, no idle getUpdates loop
+        print("Bot is listening for webhooks.")
+        try:
+            asyncio.run(run_webhook(app, token, f"{public_url.rstrip('/')}/{token}"))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print("Bot is polling.")
+        app.run_polling()
 
 if __name__ == "__main__":
-    keep_alive()
     main()